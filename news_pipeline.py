@@ -12,22 +12,38 @@ SIGNAL AI News Pipeline
   TWITTER_API_KEY / TWITTER_API_SECRET / TWITTER_ACCESS_TOKEN / TWITTER_ACCESS_SECRET
 
 実行:
-  pip install anthropic feedparser supabase tweepy python-dotenv
+  pip install anthropic feedparser supabase tweepy python-dotenv orjson
   python news_pipeline.py
 """
 
 import os
 import re
 import json
+import html
+import heapq
+import time
+import random
 import hashlib
 import logging
-from datetime import datetime, timezone
-from typing import Optional
+import threading
+import functools
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
 import feedparser
 import anthropic
-from supabase import create_client
+from supabase import Client, create_client
+from postgrest import ReturnMethod
 from dotenv import load_dotenv
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 log = logging.getLogger("signal")
@@ -40,6 +56,51 @@ log = logging.getLogger("signal")
 # "published" = 即時公開（全自動モード）
 DEFAULT_STATUS = "draft"
 
+# RSS取得の最大並列数（実際はフィード数まで）と1フィードあたりの取得時間の上限（秒。接続〜本文受信完了まで）
+FEED_WORKERS = 16
+FEED_TIMEOUT = 15
+
+# 同一プロセス内で再実行したとき、この秒数以内に取得したフィードは再ダウンロードしない
+FEED_CACHE_TTL = 300
+
+# スコアリング（単純な分類＋翻訳）は高速・安価な Haiku、ダイジェストは品質重視で Sonnet
+SCORING_MODEL = "claude-haiku-4-5"
+DIGEST_MODEL = "claude-sonnet-4-6"
+
+# "batch"    = Message Batches API で一括スコアリング（50%割引・非同期）
+# "realtime" = 1件ずつ即時スコアリング
+SCORING_MODE = "batch"
+
+# realtime スコアリングの同時実行数
+SCORING_WORKERS = 5
+
+# batch の完了確認間隔（初回 → 最大まで倍々）と待ち時間の上限（秒）。
+# 上限を超えたらキャンセルし、完了済みの結果を回収したうえで残りだけ realtime で処理
+BATCH_POLL_INTERVAL = 15
+BATCH_POLL_MAX_INTERVAL = 60
+BATCH_TIMEOUT = 1200
+BATCH_CANCEL_TIMEOUT = 120
+
+# Claude に送るタイトル・本文の最大文字数（入力トークン削減。要旨の判定にはこれで十分）
+MAX_TITLE_LEN = 200
+MAX_SUMMARY_LEN = 600
+
+# 既存記事の照会で1リクエストに含めるID数（32桁hex × 100 ≒ 3.3KB のURL。長すぎるとURL長の上限に当たる）
+EXISTING_ID_CHUNK = 100
+
+# 記事の保存で1リクエストにまとめて upsert する件数（失敗したチャンクだけ1件ずつ再試行する）
+UPSERT_CHUNK = 100
+
+# Claude に送る前の足切り（タイトル・本文の最小文字数、公開からの経過時間）
+MIN_TITLE_LEN = 10
+MIN_SUMMARY_LEN = 50
+MAX_AGE_HOURS = 48
+
+# Claude API のレート上限（アカウントの Tier に合わせて調整）と 429 時の最大試行回数
+CLAUDE_RPM = 50
+CLAUDE_TPM = 40000
+CLAUDE_MAX_RETRIES = 5
+
 RSS_SOURCES = [
     {"url": "https://arxiv.org/rss/cs.AI",            "source": "arXiv AI",        "category": "research", "trust": 95},
     {"url": "https://arxiv.org/rss/cs.LG",            "source": "arXiv ML",        "category": "research", "trust": 95},
@@ -60,13 +121,11 @@ RSS_SOURCES = [
                                                       "source": "NIST",            "category": "policy",   "trust": 97},
 ]
 
-SCORING_PROMPT = """
-あなたはAI専門のジャーナリストです。以下の記事を評価・翻訳してください。
-
-【タイトル】{title}
-【本文要約】{summary}
-【ソース】{source} (信頼度: {trust}/100)
-【カテゴリ】{category}
+# 全記事で共通の指示（system プロンプトとして送る）。cache_control を付けているが、
+# Haiku 4.5 の最小キャッシュ長（約4096トークン）に届かないため現状はキャッシュされない。
+# 指示を大きく増やすかモデルを変えて最小長を超えたときに初めて効く
+SCORING_INSTRUCTIONS = """
+あなたはAI専門のジャーナリストです。与えられた記事を評価・翻訳してください。
 
 スコアリング基準（合計100点）:
 - 新規性 30点: 新しい発見・発表か（既知情報は低スコア）
@@ -81,7 +140,7 @@ SCORING_PROMPT = """
 - 60点未満 = skip（掲載しない）
 
 JSONのみで回答（マークダウン不要）:
-{{
+{
   "score": <整数>,
   "importance": <"critical"|"high"|"normal"|"skip">,
   "title_ja": <日本語タイトル（30字以内）>,
@@ -90,18 +149,130 @@ JSONのみで回答（マークダウン不要）:
   "summary_en": <English summary (around 80 words)>,
   "key_insight": <なぜこのニュースが重要か・業界への具体的な影響（日本語2文）>,
   "tags": <タグ配列 例: ["LLM", "OpenAI", "Benchmark"]>
-}}
+}
+"""
+
+# 記事ごとに変わる部分
+ARTICLE_PROMPT = """
+【タイトル】{title}
+【本文要約】{summary}
+【ソース】{source} (信頼度: {trust}/100)
+【カテゴリ】{category}
 """
 
 # ============================================================
 # UTILITIES
 # ============================================================
 
+_SCRIPT_RE = re.compile(r'<(script|style)\b.*?</\1\s*>', re.S | re.I)
+_TAG_RE = re.compile(r'<[^>]+>')
+_WS_RE = re.compile(r'\s+')
+
 def strip_html(text: str) -> str:
-    text = re.sub(r'<[^>]+>', '', text)
-    text = text.replace('&amp;', '&').replace('&lt;', '<').replace('&gt;', '>') \
-               .replace('&quot;', '"').replace('&#39;', "'").replace('&nbsp;', ' ')
-    return re.sub(r'\s+', ' ', text).strip()
+    text = _TAG_RE.sub('', _SCRIPT_RE.sub('', text))
+    return _WS_RE.sub(' ', html.unescape(text)).strip()
+
+class TokenBucket:
+    """rate（個/秒）で補充され、capacity まで貯まるトークンバケット（スレッドセーフ）"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1) -> None:
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+_request_bucket = TokenBucket(CLAUDE_RPM / 60, CLAUDE_RPM)
+_token_bucket = TokenBucket(CLAUDE_TPM / 60, CLAUDE_TPM)
+
+def _retry_after(e: anthropic.RateLimitError, attempt: int) -> float:
+    try:
+        return float(e.response.headers["retry-after"])
+    except (KeyError, ValueError):
+        return 2 ** attempt + random.random()
+
+def claude_create(client: anthropic.Anthropic, stop_when: Optional[Callable[[str], bool]] = None,
+                  **params) -> str:
+    """
+    RPM / TPM の上限内に収まるよう待ってからストリーミングで Claude を呼び、応答テキストを返す。
+    stop_when が途中までのテキストで True を返したら、そこで生成を打ち切る。
+    429 は Retry-After（なければ指数バックオフ）だけ待って再試行。
+    """
+    est_tokens = (len(str(params.get("system", ""))) + len(str(params["messages"]))) // 4 + params["max_tokens"]
+    for attempt in range(CLAUDE_MAX_RETRIES):
+        _request_bucket.acquire()
+        _token_bucket.acquire(est_tokens)
+        try:
+            with client.messages.stream(**params) as stream:
+                if stop_when is None:
+                    return stream.get_final_text()
+                text = ""
+                for chunk in stream.text_stream:
+                    text += chunk
+                    if stop_when(text):
+                        break  # with を抜けると接続が閉じ、以降のトークンは生成されない
+                return text
+        except anthropic.RateLimitError as e:
+            if attempt == CLAUDE_MAX_RETRIES - 1:
+                raise
+            wait = _retry_after(e, attempt)
+            log.warning(f"Rate limited, retrying in {wait:.1f}s")
+            time.sleep(wait)
+
+_TRACKING_PARAMS = {"fbclid", "gclid", "ref", "mc_cid", "mc_eid"}
+
+def _is_tracking_param(segment: str) -> bool:
+    key = urllib.parse.unquote_plus(segment.split("=", 1)[0])
+    return key.startswith("utm_") or key in _TRACKING_PARAMS
+
+def canonical_url(url: str) -> str:
+    """
+    重複判定用にURLを正規化。
+    スキーム・ホストの大文字小文字、http/https、フラグメント、トラッキング用クエリの違いを吸収。
+    それ以外（パス・残りのクエリのエンコード）は元のまま残し、正規化の必要がないURLは記事IDも変わらない。
+    ※ 導入時、上記の違いを含むURL（http:// 等）の記事は一度だけ新しいIDで再スコアリングされ、
+      旧IDの行と重複して保存されうる（articles.url には一意制約がないため）。
+    """
+    p = urllib.parse.urlsplit(url)
+    segments = p.query.split("&") if p.query else []
+    kept = [q for q in segments if not _is_tracking_param(q)]
+    query = "&".join(kept) if len(kept) != len(segments) else p.query
+    scheme = p.scheme.lower()
+    if scheme == "http":
+        scheme = "https"
+    netloc = p.netloc.lower()
+    if (scheme, netloc, query, p.fragment) == (p.scheme, p.netloc, p.query, ""):
+        return url
+    return urllib.parse.urlunsplit((scheme, netloc, p.path, query, ""))
+
+def make_article_id(url: str) -> str:
+    """記事ID = 正規化URL の MD5（重複排除キーとしてのみ使用。articles.id と互換の32桁hex）"""
+    return hashlib.md5(canonical_url(url).encode(), usedforsecurity=False).hexdigest()
+
+def parse_published(entry) -> Optional[datetime]:
+    """RSSエントリの公開日時（UTC）。日付がないフィードは None"""
+    t = entry.get("published_parsed") or entry.get("updated_parsed")
+    return datetime(*t[:6], tzinfo=timezone.utc) if t else None
+
+def prefilter(article: dict) -> bool:
+    """Claude を呼ばなくても対象外とわかる記事（短すぎる・古すぎる）を除外"""
+    if len(article["title"]) < MIN_TITLE_LEN or len(article["summary"]) < MIN_SUMMARY_LEN:
+        return False
+    published = article.get("published")
+    return published is None or datetime.now(timezone.utc) - published <= timedelta(hours=MAX_AGE_HOURS)
 
 def parse_json_safe(raw: str) -> dict:
     """Claude のレスポンスから JSON を安全にパース"""
@@ -111,62 +282,181 @@ def parse_json_safe(raw: str) -> dict:
     start, end = raw.find("{"), raw.rfind("}") + 1
     if start == -1 or end == 0:
         raise ValueError("JSON not found")
+    if orjson is not None:
+        return orjson.loads(raw[start:end].encode())
     return json.loads(raw[start:end])
 
+# ============================================================
+# CLIENTS（生成コストが高いので1つだけ作って使い回す）
+# ============================================================
+
+@functools.lru_cache(maxsize=1)
+def get_supabase(supabase_url: str, supabase_key: str) -> Client:
+    return create_client(supabase_url, supabase_key)
+
+@functools.lru_cache(maxsize=1)
+def get_claude(api_key: str) -> anthropic.Anthropic:
+    return anthropic.Anthropic(api_key=api_key)
+
+@functools.lru_cache(maxsize=1)
+def get_twitter(consumer_key: str, consumer_secret: str, access_token: str, access_token_secret: str):
+    import tweepy
+    return tweepy.Client(
+        consumer_key=consumer_key, consumer_secret=consumer_secret,
+        access_token=access_token, access_token_secret=access_token_secret,
+    )
+
 # ============================================================
 # STEP 0: 既存記事を取得（APIコスト削減の核心）
 # ============================================================
 
-def get_existing_ids(supabase_url: str, supabase_key: str) -> set:
+def get_existing_ids(candidate_ids: list[str], sb: Optional[Client]) -> set:
     """
-    DB内の既存記事IDを取得。
-    フェッチした記事がすでにDBにあればClaudeを呼ばずスキップ。
+    フェッチした記事のうち、すでにDBにある記事IDを取得。
+    該当する記事はClaudeを呼ばずスキップ。
     2回目以降の実行でAPIコストを大幅削減（平均80%減）。
     """
-    if not supabase_url or not supabase_key:
+    if not candidate_ids or sb is None:
         return set()
     try:
-        sb = create_client(supabase_url, supabase_key)
-        result = sb.table("articles").select("id").execute()
-        ids = {row["id"] for row in (result.data or [])}
-        log.info(f"Existing articles in DB: {len(ids)}")
+        ids = set()
+        # IN 句は URL のクエリに載るので、長くなりすぎないよう分割して問い合わせる
+        for i in range(0, len(candidate_ids), EXISTING_ID_CHUNK):
+            chunk = candidate_ids[i:i + EXISTING_ID_CHUNK]
+            result = sb.table("articles").select("id").in_("id", chunk).execute()
+            ids.update(row["id"] for row in (result.data or []))
+        log.info(f"Already in DB: {len(ids)}/{len(candidate_ids)}")
         return ids
     except Exception as e:
         log.warning(f"Could not fetch existing IDs: {e}")
         return set()
 
+def load_feed_state(sb: Optional[Client]) -> dict:
+    """
+    前回取得時の ETag / Last-Modified をフィードURLごとに取得。
+    条件付きGETで未更新フィード（304）のダウンロードとパースを省く。
+    """
+    if sb is None:
+        return {}
+    try:
+        result = sb.table("feed_state").select("source_url, etag, modified").execute()
+        return {row["source_url"]: row for row in (result.data or [])}
+    except Exception as e:
+        log.warning(f"Could not load feed state: {e}")
+        return {}
+
+def save_feed_state(feed_state: dict, sb: Optional[Client]) -> None:
+    if not feed_state or sb is None:
+        return
+    try:
+        sb.table("feed_state").upsert(
+            list(feed_state.values()), on_conflict="source_url", returning=ReturnMethod.minimal
+        ).execute()
+    except Exception as e:
+        log.warning(f"Could not save feed state: {e}")
+
 # ============================================================
 # STEP 1: RSS収集
 # ============================================================
 
-def fetch_feeds() -> list[dict]:
-    articles = []
-    seen_urls = set()
+_feed_cache: dict[str, tuple[float, feedparser.FeedParserDict]] = {}
 
-    for source in RSS_SOURCES:
-        try:
-            feed = feedparser.parse(source["url"])
-            count = 0
-            for entry in feed.entries[:5]:
-                url = entry.get("link", "")
-                if not url or url in seen_urls:
+def download_feed(url: str, etag: Optional[str] = None, modified: Optional[str] = None) -> feedparser.FeedParserDict:
+    """
+    条件付きGETでフィードを取得してパース。未更新なら status=304 の空の結果を返す。
+    FEED_TIMEOUT は1回の読み込み待ちではなく、接続から本文受信完了までの合計時間の上限。
+    """
+    headers = {"User-Agent": feedparser.USER_AGENT}
+    if etag:
+        headers["If-None-Match"] = etag
+    if modified:
+        headers["If-Modified-Since"] = modified
+    deadline = time.monotonic() + FEED_TIMEOUT
+    try:
+        resp = urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=FEED_TIMEOUT)
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return feedparser.FeedParserDict(status=304, entries=[])
+        raise
+
+    with resp:
+        body = bytearray()
+        # read1 は受信済みの分だけ返すので、少しずつ届くフィードでも締め切りを判定できる
+        while chunk := resp.read1(64 * 1024):
+            body += chunk
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"feed download exceeded {FEED_TIMEOUT}s")
+        response_headers = {k.lower(): v for k, v in resp.headers.items()}
+        # 相対リンクをフィードのURL基準で解決させる
+        response_headers.setdefault("content-location", resp.geturl())
+        feed = feedparser.parse(bytes(body), response_headers=response_headers)
+        feed["status"] = resp.status
+        feed["etag"] = resp.headers.get("ETag")
+        feed["modified"] = resp.headers.get("Last-Modified")
+    return feed
+
+def cached_parse(url: str, etag: Optional[str] = None, modified: Optional[str] = None) -> feedparser.FeedParserDict:
+    """FEED_CACHE_TTL 秒以内に取得済みのフィードはキャッシュを返す（取得に失敗した場合は例外でキャッシュしない）"""
+    hit = _feed_cache.get(url)
+    if hit and time.monotonic() - hit[0] < FEED_CACHE_TTL:
+        return hit[1]
+    feed = download_feed(url, etag=etag, modified=modified)
+    _feed_cache[url] = (time.monotonic(), feed)
+    return feed
+
+def _collect(source: dict, state: dict) -> tuple[feedparser.FeedParserDict, list[dict]]:
+    """1フィード分の取得と記事の組み立て（スレッドプール上で実行）"""
+    feed = cached_parse(source["url"], etag=state.get("etag"), modified=state.get("modified"))
+    articles = [
+        {
+            "id":           make_article_id(url),
+            "title":        strip_html(entry.get("title", ""))[:MAX_TITLE_LEN],
+            "summary":      strip_html(entry.get("summary", entry.get("description", "")))[:MAX_SUMMARY_LEN],
+            "url":          url,
+            "source":       source["source"],
+            "source_trust": source["trust"],
+            "category":     source["category"],
+            "published":    parse_published(entry),
+        }
+        for entry in feed.entries[:5]
+        if (url := entry.get("link", ""))
+    ]
+    return feed, articles
+
+def fetch_feeds(feed_state: Optional[dict] = None) -> list[dict]:
+    """feed_state を渡すと条件付きGETを行い、取得後の ETag / Last-Modified で更新する"""
+    articles = []
+    seen_ids = set()
+    if feed_state is None:
+        feed_state = {}
+
+    # 取得と記事の組み立てはスレッドで並列化し、重複排除（正規化URL由来のID）はメインスレッドで行う
+    with ThreadPoolExecutor(max_workers=min(FEED_WORKERS, len(RSS_SOURCES))) as ex:
+        futures = {ex.submit(_collect, s, feed_state.get(s["url"], {})): s for s in RSS_SOURCES}
+        for future in as_completed(futures):
+            source = futures[future]
+            try:
+                feed, entries = future.result()
+                if feed.get("status") == 304:
+                    log.info(f"- {source['source']}: not modified")
                     continue
-                seen_urls.add(url)
-
-                article_id = hashlib.md5(url.encode()).hexdigest()
-                articles.append({
-                    "id":           article_id,
-                    "title":        strip_html(entry.get("title", "")),
-                    "summary":      strip_html(entry.get("summary", entry.get("description", "")))[:2000],
-                    "url":          url,
-                    "source":       source["source"],
-                    "source_trust": source["trust"],
-                    "category":     source["category"],
-                })
-                count += 1
-            log.info(f"✓ {source['source']}: {count} entries")
-        except Exception as e:
-            log.warning(f"✗ {source['source']}: {e}")
+                # 正常に取得できたときだけ更新（失敗時に前回の ETag / Last-Modified を消さない）
+                if feed.get("status") == 200:
+                    feed_state[source["url"]] = {
+                        "source_url": source["url"],
+                        "etag":       feed.get("etag"),
+                        "modified":   feed.get("modified"),
+                    }
+                count = 0
+                for article in entries:
+                    if article["id"] in seen_ids:
+                        continue
+                    seen_ids.add(article["id"])
+                    articles.append(article)
+                    count += 1
+                log.info(f"✓ {source['source']}: {count} entries")
+            except Exception as e:
+                log.warning(f"✗ {source['source']}: {e}")
 
     log.info(f"Total fetched: {len(articles)}")
     return articles
@@ -175,71 +465,181 @@ def fetch_feeds() -> list[dict]:
 # STEP 2: スコアリング + 日英生成（新規記事のみ）
 # ============================================================
 
-def score_and_translate(articles: list[dict], client: anthropic.Anthropic) -> list[dict]:
-    results = []
-    for article in articles:
-        try:
-            prompt = SCORING_PROMPT.format(
-                title=article["title"],
-                summary=article["summary"],
-                source=article["source"],
-                trust=article["source_trust"],
-                category=article["category"],
-            )
-            response = client.messages.create(
-                model="claude-sonnet-4-6",
-                max_tokens=1024,
-                messages=[{"role": "user", "content": prompt}]
-            )
-            scored = parse_json_safe(response.content[0].text.strip())
-
-            if scored.get("importance") == "skip" or scored.get("score", 0) < 60:
-                log.info(f"SKIP ({scored.get('score')}): {article['title'][:50]}")
-                continue
-
-            article.update(scored)
-            article["processed_at"] = datetime.now(timezone.utc).isoformat()
-            results.append(article)
-            log.info(f"✓ [{scored['score']}] {scored['importance'].upper()}: {scored.get('title_ja','')[:40]}")
+def _scoring_params(article: dict, model: str) -> dict:
+    prompt = ARTICLE_PROMPT.format(
+        title=article["title"],
+        summary=article["summary"],
+        source=article["source"],
+        trust=article["source_trust"],
+        category=article["category"],
+    )
+    return {
+        "model": model,
+        "max_tokens": 768,
+        "system": [{"type": "text", "text": SCORING_INSTRUCTIONS, "cache_control": {"type": "ephemeral"}}],
+        "messages": [{"role": "user", "content": prompt}],
+    }
+
+def _apply_score(article: dict, raw: str) -> bool:
+    """スコア結果を記事に反映。掲載対象なら True"""
+    scored = parse_json_safe(raw.strip())
+
+    if scored.get("importance") == "skip" or scored.get("score", 0) < 60:
+        log.info(f"SKIP ({scored.get('score')}): {article['title'][:50]}")
+        return False
+
+    article.update(scored)
+    log.info(f"✓ [{scored['score']}] {scored['importance'].upper()}: {scored.get('title_ja','')[:40]}")
+    return True
+
+_SCORE_RE = re.compile(r'"score"\s*:\s*(\d+)\s*[,}]')
+
+def _early_skip(text: str) -> bool:
+    """score はJSONの先頭項目なので、受信途中でも掲載基準（60点）未満かを判定できる"""
+    m = _SCORE_RE.search(text)
+    return bool(m) and int(m.group(1)) < 60
+
+def _score_one(article: dict, client: anthropic.Anthropic, model: str) -> Optional[bool]:
+    """掲載対象なら True、基準未満なら False、エラーで判定できなければ None"""
+    try:
+        raw = claude_create(client, stop_when=_early_skip, **_scoring_params(article, model))
+        if _early_skip(raw):
+            log.info(f"SKIP ({_SCORE_RE.search(raw).group(1)}): {article['title'][:50]}")
+            return False
+        return _apply_score(article, raw)
+    except Exception as e:
+        log.warning(f"Score error '{article['title'][:40]}': {e}")
+        return None
 
+def _score_realtime(articles: list[dict], client: anthropic.Anthropic,
+                    model: str) -> tuple[list[dict], list[dict]]:
+    """(掲載対象の記事, エラーで判定できなかった記事) を返す"""
+    # 1件ずつ独立した呼び出しなので SCORING_WORKERS 件まで同時に投げる（レート制御は claude_create 側）
+    with ThreadPoolExecutor(max_workers=SCORING_WORKERS) as ex:
+        outcomes = list(ex.map(lambda a: _score_one(a, client, model), articles))
+    passed = [a for a, ok in zip(articles, outcomes) if ok]
+    failed = [a for a, ok in zip(articles, outcomes) if ok is None]
+    return passed, failed
+
+def _score_batch(articles: list[dict], client: anthropic.Anthropic,
+                 model: str) -> tuple[list[dict], list[dict], list[dict]]:
+    """
+    Message Batches API で一括スコアリングし、
+    (掲載対象の記事, エラーで判定できなかった記事, 結果が返らず realtime で再処理すべき記事) を返す。
+    BATCH_TIMEOUT 内に終わらなければキャンセルし、それまでに完了した分の結果は使う。
+    """
+    batch = client.messages.batches.create(requests=[
+        {"custom_id": a["id"], "params": _scoring_params(a, model)} for a in articles
+    ])
+    log.info(f"Batch submitted: {batch.id} ({len(articles)} requests)")
+
+    deadline = time.monotonic() + BATCH_TIMEOUT
+    interval = BATCH_POLL_INTERVAL
+    cancelled = False
+    while batch.processing_status != "ended":
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            if cancelled:
+                log.warning(f"Batch {batch.id} did not end after cancel, rescoring all in realtime")
+                return [], [], articles
+            # キャンセルしても完了済みのリクエストは課金されるので、ended まで待って結果を回収する
+            log.warning(f"Batch {batch.id} timed out, cancelling")
+            client.messages.batches.cancel(batch.id)
+            cancelled = True
+            deadline = time.monotonic() + BATCH_CANCEL_TIMEOUT
+            interval = BATCH_POLL_INTERVAL
+            remaining = BATCH_CANCEL_TIMEOUT
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, BATCH_POLL_MAX_INTERVAL)
+        batch = client.messages.batches.retrieve(batch.id)
+
+    by_id = {a["id"]: a for a in articles}
+    passed, failed, done = [], [], set()
+    for entry in client.messages.batches.results(batch.id):
+        article = by_id.get(entry.custom_id)
+        if article is None or entry.result.type != "succeeded":
+            continue
+        done.add(article["id"])
+        try:
+            if _apply_score(article, entry.result.message.content[0].text):
+                passed.append(article)
         except Exception as e:
             log.warning(f"Score error '{article['title'][:40]}': {e}")
+            failed.append(article)
 
-    log.info(f"Passed scoring: {len(results)}/{len(articles)}")
-    return results
+    pending = [a for a in articles if a["id"] not in done]
+    if pending:
+        log.info(f"Batch {batch.id}: {len(pending)} requests without result, rescoring in realtime")
+    return passed, failed, pending
+
+def score_and_translate(articles: list[dict], client: anthropic.Anthropic,
+                        model: str = SCORING_MODEL) -> tuple[list[dict], int]:
+    """
+    (掲載対象の記事, エラーで判定できなかった件数) を返す。
+    基準未満による SKIP はエラーに数えない。
+    """
+    # 処理時刻は実行単位で1回だけ取得して全記事に使う
+    processed_at = datetime.now(timezone.utc).isoformat()
+    results, failed, pending = [], [], articles
+    if SCORING_MODE == "batch":
+        try:
+            results, failed, pending = _score_batch(articles, client, model)
+        except Exception as e:
+            log.warning(f"Batch scoring failed: {e}")
+    if pending:
+        passed, errored = _score_realtime(pending, client, model)
+        results += passed
+        failed += errored
+    for article in results:
+        article["processed_at"] = processed_at
+
+    log.info(f"Passed scoring: {len(results)}/{len(articles)} (errors: {len(failed)})")
+    return results, len(failed)
 
 # ============================================================
 # STEP 3: Supabaseに保存
 # ============================================================
 
-def save_to_supabase(articles: list[dict], supabase_url: str, supabase_key: str) -> int:
-    if not supabase_url or not supabase_key:
+def _article_row(article: dict) -> dict:
+    return {
+        "id":           article["id"],
+        "title_ja":     article.get("title_ja", ""),
+        "title_en":     article.get("title_en", ""),
+        "summary_ja":   article.get("summary_ja", ""),
+        "summary_en":   article.get("summary_en", ""),
+        "key_insight":  article.get("key_insight", ""),
+        "url":          article["url"],
+        "source":       article["source"],
+        "category":     article["category"],
+        "score":        article.get("score", 0),
+        "importance":   article.get("importance", "normal"),
+        "tags":         article.get("tags", []),
+        "processed_at": article.get("processed_at"),
+        "status":       DEFAULT_STATUS,
+    }
+
+def save_to_supabase(articles: list[dict], sb: Optional[Client]) -> int:
+    if sb is None:
         log.warning("Supabase not configured, skipping")
         return 0
 
-    sb = create_client(supabase_url, supabase_key)
+    rows = [_article_row(a) for a in articles]
     saved = 0
-    for article in articles:
+
+    # UPSERT_CHUNK 件ずつまとめて upsert。失敗したチャンクだけ原因を特定するため1件ずつ再試行
+    for i in range(0, len(rows), UPSERT_CHUNK):
+        chunk = rows[i:i + UPSERT_CHUNK]
         try:
-            sb.table("articles").upsert({
-                "id":           article["id"],
-                "title_ja":     article.get("title_ja", ""),
-                "title_en":     article.get("title_en", ""),
-                "summary_ja":   article.get("summary_ja", ""),
-                "summary_en":   article.get("summary_en", ""),
-                "key_insight":  article.get("key_insight", ""),
-                "url":          article["url"],
-                "source":       article["source"],
-                "category":     article["category"],
-                "score":        article.get("score", 0),
-                "importance":   article.get("importance", "normal"),
-                "tags":         article.get("tags", []),
-                "processed_at": article.get("processed_at"),
-                "status":       DEFAULT_STATUS,
-            }, on_conflict="id").execute()
-            saved += 1
+            sb.table("articles").upsert(chunk, on_conflict="id", returning=ReturnMethod.minimal).execute()
+            saved += len(chunk)
         except Exception as e:
-            log.warning(f"DB error '{article.get('title_ja','')}': {e}")
+            log.warning(f"Bulk upsert failed, retrying per row: {e}")
+            for row in chunk:
+                try:
+                    sb.table("articles").upsert(row, on_conflict="id", returning=ReturnMethod.minimal).execute()
+                    saved += 1
+                except Exception as e:
+                    log.warning(f"DB error '{row['title_ja']}': {e}")
 
     log.info(f"Saved {saved}/{len(articles)} articles (status={DEFAULT_STATUS})")
     return saved
@@ -248,6 +648,55 @@ def save_to_supabase(articles: list[dict], supabase_url: str, supabase_key: str)
 # STEP 4: X投稿（published モードかつX設定済みのみ）
 # ============================================================
 
+TWEET_TEMPLATE = (
+    "🔔 [{importance}] {title}\n\n"
+    "💡 {insight}\n\n"
+    "📊 Score: {score}/100\n"
+    "🔗 {url}\n\n"
+    "{tags} #AINews #SIGNAL"
+)
+TWEET_MAX_WEIGHT = 280
+TCO_URL_WEIGHT = 23   # URL は t.co で短縮され一律23文字として数えられる
+
+def tweet_weight(text: str) -> int:
+    """X の文字数カウント（ラテン文字等は1、日本語・絵文字は2）"""
+    return sum(
+        1 if o <= 0x10FF or 0x2000 <= o <= 0x200D or 0x2010 <= o <= 0x201F or 0x2032 <= o <= 0x2037 else 2
+        for o in map(ord, text)
+    )
+
+def truncate_weight(text: str, budget: int) -> str:
+    if tweet_weight(text) <= budget:
+        return text
+    budget -= 3  # "..."
+    out = []
+    for c in text:
+        budget -= tweet_weight(c)
+        if budget < 0:
+            break
+        out.append(c)
+    return "".join(out) + "..."
+
+def format_tweet(a: dict) -> str:
+    """URL を残したまま 280 に収まるよう、タイトルと key_insight を先に切り詰めて組み立てる"""
+    fields = {
+        "importance": a.get("importance", "").upper(),
+        "score":      a.get("score", 0),
+        "tags":       " ".join(f"#{t.replace(' ','')}" for t in a.get("tags", [])[:3]),
+    }
+    chrome = tweet_weight(TWEET_TEMPLATE.format(title="", insight="", url="", **fields)) + TCO_URL_WEIGHT
+    budget = max(0, TWEET_MAX_WEIGHT - chrome)
+    title = truncate_weight(a.get("title_ja", ""), budget // 2)
+    insight = truncate_weight(a.get("key_insight", ""), budget - tweet_weight(title))
+    return TWEET_TEMPLATE.format(title=title, insight=insight, url=a.get("url", ""), **fields)
+
+def _post_one(client, a: dict) -> None:
+    try:
+        client.create_tweet(text=format_tweet(a))
+        log.info(f"Tweeted: {a.get('title_ja','')[:40]}")
+    except Exception as e:
+        log.warning(f"Tweet error: {e}")
+
 def post_to_twitter(articles: list[dict]) -> None:
     if DEFAULT_STATUS == "draft":
         log.info("Draft mode: X posting skipped")
@@ -262,31 +711,13 @@ def post_to_twitter(articles: list[dict]) -> None:
         return
 
     try:
-        import tweepy
-        client = tweepy.Client(
-            consumer_key=keys[0], consumer_secret=keys[1],
-            access_token=keys[2], access_token_secret=keys[3],
-        )
+        client = get_twitter(*keys)
     except ImportError:
         return
 
     to_post = [a for a in articles if a.get("importance") in ("critical", "high")][:3]
-    for a in to_post:
-        tags = " ".join(f"#{t.replace(' ','')}" for t in a.get("tags", [])[:3])
-        tweet = (
-            f"🔔 [{a.get('importance','').upper()}] {a.get('title_ja','')}\n\n"
-            f"💡 {a.get('key_insight','')}\n\n"
-            f"📊 Score: {a.get('score',0)}/100\n"
-            f"🔗 {a.get('url','')}\n\n"
-            f"{tags} #AINews #SIGNAL"
-        )
-        if len(tweet) > 280:
-            tweet = tweet[:277] + "..."
-        try:
-            client.create_tweet(text=tweet)
-            log.info(f"Tweeted: {a.get('title_ja','')[:40]}")
-        except Exception as e:
-            log.warning(f"Tweet error: {e}")
+    with ThreadPoolExecutor(max_workers=3) as ex:
+        list(ex.map(lambda a: _post_one(client, a), to_post))
 
 # ============================================================
 # STEP 5: デイリーダイジェスト（1日1回・UTC0時台のみ）
@@ -295,14 +726,15 @@ def post_to_twitter(articles: list[dict]) -> None:
 def generate_daily_digest(articles: list[dict], client: anthropic.Anthropic) -> Optional[str]:
     if not articles:
         return None
-    top = sorted(articles, key=lambda x: x.get("score", 0), reverse=True)[:5]
+    top = heapq.nlargest(5, articles, key=lambda x: x.get("score", 0))
     summaries = "\n".join(
         f"- [{a['source']}] {a.get('title_ja','')}: {a.get('key_insight','')}"
         for a in top
     )
     try:
-        response = client.messages.create(
-            model="claude-sonnet-4-6",
+        return claude_create(
+            client,
+            model=DIGEST_MODEL,
             max_tokens=800,
             messages=[{"role": "user", "content": f"""
 本日のAIニューストップ5からニュースレター用デイリーダイジェストを作成してください。
@@ -316,7 +748,6 @@ def generate_daily_digest(articles: list[dict], client: anthropic.Anthropic) ->
 - 英語版
 """}]
         )
-        return response.content[0].text
     except Exception as e:
         log.warning(f"Digest failed: {e}")
         return None
@@ -333,51 +764,74 @@ def run_pipeline():
     api_key = os.getenv("ANTHROPIC_API_KEY")
     if not api_key:
         raise ValueError("ANTHROPIC_API_KEY is required")
-    claude = anthropic.Anthropic(api_key=api_key)
 
     supabase_url = os.getenv("SUPABASE_URL", "")
     supabase_key = os.getenv("SUPABASE_KEY", "")
-
-    # Step 0: 既存IDを取得（Claudeコストを大幅削減）
-    existing_ids = get_existing_ids(supabase_url, supabase_key)
-
-    # Step 1: RSS収集
-    all_articles = fetch_feeds()
+    # Supabase クライアントは1つだけ作り、各ステップで接続を使い回す（未設定なら None）
+    sb = get_supabase(supabase_url, supabase_key) if supabase_url and supabase_key else None
+
+    # Step 1: RSS収集（未更新のフィードは条件付きGETでスキップ）
+    # 取得状態は、新規記事が全件判定済みかつ掲載対象を全件保存できたときだけ保存する
+    # （スコアリングや保存に失敗した場合は次回も同じフィードを再取得する）
+    feed_state = load_feed_state(sb)
+    all_articles = fetch_feeds(feed_state)
     if not all_articles:
-        log.error("No articles fetched")
+        log.info("No articles fetched (feeds not modified or unavailable)")
         return
 
+    # 明らかに対象外の記事は DB 照会・スコアリングの前に除外
+    fetched = len(all_articles)
+    all_articles = [a for a in all_articles if prefilter(a)]
+    log.info(f"Passed prefilter: {len(all_articles)}/{fetched}")
+
+    # Step 0: 取得した記事のうち既存IDを確認（Claudeコストを大幅削減）
+    existing_ids = get_existing_ids([a["id"] for a in all_articles], sb)
+
     # 新規記事のみフィルタ（★ここがコスト削減の核心★）
     new_articles = [a for a in all_articles if a["id"] not in existing_ids]
     log.info(f"New articles to process: {len(new_articles)}/{len(all_articles)}")
 
     if not new_articles:
+        save_feed_state(feed_state, sb)
         log.info("No new articles. Pipeline complete.")
         return
 
-    # Step 2: 新規のみスコアリング
-    scored = score_and_translate(new_articles, claude)
+    # Step 2: 新規のみスコアリング（Claude クライアントは処理対象があるときだけ生成）
+    claude = get_claude(api_key)
+    scored, score_errors = score_and_translate(new_articles, claude)
     if not scored:
+        if not score_errors:
+            save_feed_state(feed_state, sb)
         log.info("No articles passed scoring threshold")
         return
 
-    # Step 3: DB保存
-    saved = save_to_supabase(scored, supabase_url, supabase_key)
+    # Step 3: DB保存 → Step 5: 1日1回のダイジェスト（UTC 0時台・保存できた場合のみ）
+    def save_then_digest() -> tuple[int, Optional[str]]:
+        saved = save_to_supabase(scored, sb)
+        if datetime.now(timezone.utc).hour == 0 and saved > 0:
+            return saved, generate_daily_digest(scored, claude)
+        return saved, None
+
+    # Step 4: X投稿は保存・ダイジェストと依存しないため並列実行
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        save_future = ex.submit(save_then_digest)
+        tweet_future = ex.submit(post_to_twitter, scored)
 
-    # Step 4: X投稿
-    post_to_twitter(scored)
+    saved, digest = save_future.result()
+    if not score_errors and saved == len(scored):
+        save_feed_state(feed_state, sb)
+    else:
+        log.warning("Some articles were not scored or saved; feed state left unchanged for retry")
+    tweet_future.result()
 
-    # Step 5: 1日1回のダイジェスト（UTC 0時台）
-    if datetime.now(timezone.utc).hour == 0 and saved > 0:
-        digest = generate_daily_digest(scored, claude)
-        if digest:
-            log.info(f"\n{'='*40}\nDAILY DIGEST:\n{digest}\n{'='*40}")
+    if digest:
+        log.info(f"\n{'='*40}\nDAILY DIGEST:\n{digest}\n{'='*40}")
 
     log.info("=" * 50)
     log.info(f"Done: {saved} new articles saved [{DEFAULT_STATUS}]")
     if DEFAULT_STATUS == "draft":
         log.info(">> Supabase で status を 'published' に変更するとサイトに表示されます")
-    for a in sorted(scored, key=lambda x: x.get("score", 0), reverse=True)[:5]:
+    for a in heapq.nlargest(5, scored, key=lambda x: x.get("score", 0)):
         log.info(f"  [{a.get('score')}] {a.get('importance','').upper()}: {a.get('title_ja','')[:50]}")
     log.info("=" * 50)
 
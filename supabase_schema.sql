@@ -36,11 +36,20 @@ CREATE TABLE IF NOT EXISTS subscribers (
   active     BOOLEAN DEFAULT true
 );
 
+-- feed_state テーブル（RSSの条件付きGET用。パイプラインのみが読み書き）
+CREATE TABLE IF NOT EXISTS feed_state (
+  source_url TEXT PRIMARY KEY,
+  etag       TEXT,
+  modified   TEXT
+);
+
 -- ============================================================
 -- RLS（Row Level Security）設定
 -- ============================================================
 ALTER TABLE articles    ENABLE ROW LEVEL SECURITY;
 ALTER TABLE subscribers ENABLE ROW LEVEL SECURITY;
+-- feed_state: ポリシーなし = service_role 以外はアクセス不可
+ALTER TABLE feed_state  ENABLE ROW LEVEL SECURITY;
 
 -- 既存ポリシーを削除してから再作成（冪等性確保）
 DROP POLICY IF EXISTS "Public read articles"  ON articles;